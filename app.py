@@ -1,83 +1,70 @@
+import threading
+
 import numpy as np
 import matplotlib.pyplot as plt
 import streamlit as st
 
-# Constants with hematocrit factors
-METHODS = {
-    'Whole Blood': {
-        'efficiency': 0.25,
-        'volume_factor': 1.0,
-        'hct_impact': 0.2,  # 20% hematocrit sensitivity
-        'rbc_contam': 50.0,  # RBC contamination (×10⁹ per L)
-        'cd3_estimate': lambda tlc, lymph: 60 + 10*(tlc/15) + 5*(lymph/50),  # CD3% estimation function
-        'params': {}
-    },
-    'Haemonetics': {
-        'efficiency': 0.85,
-        'volume_factor': 0.3,
-        'hct_impact': 0.6,  # 60% hematocrit sensitivity
-        'rbc_contam': 15.0,  # Higher RBC contamination
-        'cd3_estimate': lambda tlc, lymph: 70 + 15*(tlc/15) + 10*(lymph/50),  # Better CD3+ selection
-        'params': {
-            'flow_rate': (40, 60),
-            'acd_ratio': (11, 13),
-            'plasma_removal': (5, 15)
-        }
-    },
-    'Spectra Optia': {
-        'efficiency': 0.95,
-        'volume_factor': 0.2,
-        'hct_impact': 0.4,  # 40% hematocrit sensitivity
-        'rbc_contam': 10.0,  # Lower RBC contamination
-        'cd3_estimate': lambda tlc, lymph: 75 + 20*(tlc/15) + 15*(lymph/50),  # Best CD3+ selection
-        'params': {
-            'flow_rate': (50, 70),
-            'acd_ratio': (12, 14),
-            'plasma_removal': (5, 10)
-        }
-    }
-}
+from dli_core import METHODS, RECOMMENDED_DOSES, calculate_dli, sweep_volumes
 
-RECOMMENDED_DOSES = {
-    'Matched Sibling': 10,  # 1×10⁷ CD3+/kg
-    'Haploidentical': 1     # 1×10⁶ CD3+/kg (1 log lower)
+# Optional inputs; when off, Hct is fixed at the 40% baseline and CD3% is estimated
+FEATURES = {
+    'hct': True,             # Donor hematocrit slider
+    'cd3_estimator': True    # Estimate CD3% from method/TLC/lymphocytes instead of entering it
 }
 
-def calculate_dli(dose, recipient_weight, donor_tlc, lymph_percent, donor_hct, method):
-    """Calculate required collection volume and optimal parameters for DLI with hematocrit adjustment"""
-    method_data = METHODS[method]
+@st.cache_resource
+def _make_fig():
+    """Figure skeleton reused across reruns; render_plot only swaps the data"""
+    fig, ax1 = plt.subplots(figsize=(10, 6))
+    
+    # Main volume curve, current and recommended dose markers
+    curve, = ax1.plot([], [], 'b-', linewidth=2, label='Volume Curve')
+    selected, = ax1.plot([], [], 'o', color='red', markersize=14, label='Selected Dose')
+    recommended, = ax1.plot([], [], 'D', color='green', markersize=14, label='Recommended Dose')
+    
+    ax1.set_xlabel('DLI Dose (×10⁶ CD3+ cells/kg)')
+    ax1.set_ylabel('Required Volume (mL)', color='b')
+    ax1.grid(True, alpha=0.3)
+    ax1.legend()
     
-    # Estimate CD3% based on method, TLC and lymphocyte %
-    cd3_percent = method_data['cd3_estimate'](donor_tlc, lymph_percent)
-    cd3_percent = min(max(cd3_percent, 50), 95)  # Keep within reasonable bounds
+    # Secondary axis for total cells
+    ax2 = ax1.twinx()
+    total_cells, = ax2.plot([], [], 'g--', alpha=0.5)
+    ax2.set_ylabel('Total CD3+ Cells (×10⁸)', color='g')
     
-    required_cd3 = dose * recipient_weight
-    cd3_conc = donor_tlc * 1e3 * (lymph_percent/100) * (cd3_percent/100)
+    # The figure is shared by all sessions, so updates and rendering are serialized
+    return fig, (ax1, ax2), (curve, selected, recommended, total_cells), threading.Lock()
+
+def render_plot(dose, volume, donor_type, recipient_weight, donor_tlc, lymph_percent, cd3_percent, donor_hct, method):
+    """Draw the dose-volume curve with the selected and recommended dose markers"""
+    fig, axes, (curve, selected, recommended, total_cells), lock = _make_fig()
     
-    # Hematocrit efficiency correction (normalized to 40% Hct)
-    hct_efficiency = 1 - method_data['hct_impact'] * (donor_hct - 40)/40
+    # Generate points for the curve
+    doses, volumes = sweep_volumes(recipient_weight, donor_tlc, lymph_percent, cd3_percent, donor_hct, method)
     
-    # Adjusted volume calculation with Hct impact
-    volume = (required_cd3 / (cd3_conc * method_data['efficiency'] * hct_efficiency)) * method_data['volume_factor'] / 1e3
+    doses_m6 = doses/np.float32(1e6)
     
-    # RBC contamination calculation
-    rbc_contamination = method_data['rbc_contam'] * (donor_hct/40) * (volume/0.5)  # Normalized to 0.5L
+    # Volume at the recommended dose
+    recommended_vol, *_ = calculate_dli(
+        RECOMMENDED_DOSES[donor_type] * 1e6,
+        recipient_weight,
+        donor_tlc,
+        lymph_percent,
+        donor_hct,
+        method,
+        cd3_percent  # CD3% does not depend on dose; reuse the resolved value
+    )
     
-    params = {}
-    if method != 'Whole Blood':
-        # Adjust flow rate based on Hct
-        base_flow = METHODS[method]['params']['flow_rate'][0] + (METHODS[method]['params']['flow_rate'][1]-METHODS[method]['params']['flow_rate'][0])*(lymph_percent/100)
-        flow_rate = base_flow * (1 - 0.2*(donor_hct-40)/40)  # Reduce flow for high Hct
-        flow_rate = max(METHODS[method]['params']['flow_rate'][0], min(METHODS[method]['params']['flow_rate'][1], flow_rate))
+    with lock:
+        curve.set_data(doses_m6, volumes)
+        selected.set_data([dose], [volume])
+        recommended.set_data([RECOMMENDED_DOSES[donor_type]], [recommended_vol])
+        total_cells.set_data(doses_m6, doses*np.float32(recipient_weight/1e8))
+        for ax in axes:
+            ax.relim()
+            ax.autoscale_view()
         
-        params = {
-            'Flow Rate': f"{flow_rate:.1f} mL/min",
-            'ACD Ratio': f"1:{int((METHODS[method]['params']['acd_ratio'][0] + METHODS[method]['params']['acd_ratio'][1])/2 + (1 if donor_hct > 45 else 0))}",
-            'Plasma Removal': f"{METHODS[method]['params']['plasma_removal'][0] + (5 if donor_hct > 45 else 0)} mL",
-            'Hct Efficiency': f"{hct_efficiency:.2f}",
-            'Estimated CD3%': f"{cd3_percent:.1f}%"
-        }
-    return volume, rbc_contamination, params, cd3_percent
+        st.pyplot(fig, clear_figure=False)
 
 def main():
     st.set_page_config(page_title="DLI Calculator", layout="wide")
@@ -90,48 +77,67 @@ def main():
     - **Haploidentical Donor:** 1 ×10⁶ CD3+ cells/kg (1 log lower)
     """)
     
-    col1, col2 = st.columns(2)
+    # Donor type stays outside the form so the dose default follows it immediately
+    donor_type = st.selectbox("Donor Type", list(RECOMMENDED_DOSES.keys()))
+    recommended_dose = RECOMMENDED_DOSES[donor_type]
     
-    with col1:
-        donor_type = st.selectbox("Donor Type", list(RECOMMENDED_DOSES.keys()))
-        # Show recommended dose next to the slider
-        recommended_dose = RECOMMENDED_DOSES[donor_type]
-        dose = st.slider(
-            f"Dose (×10⁶ CD3+ cells/kg) [Recommended: {recommended_dose}]", 
-            0.1, 20.0, float(recommended_dose), 0.1
-        )
-        recipient_weight = st.number_input("Recipient Weight (kg)", min_value=30, max_value=120, value=70)
-        method = st.selectbox("Collection Method", list(METHODS.keys()))
+    # Batch the inputs: dragging a slider no longer reruns the app until submitted
+    with st.form("params"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            # Show recommended dose next to the slider
+            dose = st.slider(
+                f"Dose (×10⁶ CD3+ cells/kg) [Recommended: {recommended_dose}]", 
+                0.1, 20.0, float(recommended_dose), 0.1
+            )
+            recipient_weight = st.number_input("Recipient Weight (kg)", min_value=30, max_value=120, value=70)
+            method = st.selectbox("Collection Method", list(METHODS.keys()))
+            
+        with col2:
+            donor_tlc = st.slider("Donor TLC (×10³/μL)", min_value=2.0, max_value=30.0, value=8.0, step=0.5)
+            lymph_percent = st.slider("Lymphocyte %", min_value=10, max_value=90, value=30)
+            if FEATURES['hct']:
+                donor_hct = st.slider("Donor Hematocrit (%)", min_value=30.0, max_value=60.0, value=40.0, step=0.1,
+                                    help="Critical for collection efficiency and RBC contamination")
+            else:
+                donor_hct = 40.0
+            cd3_input = None
+            if not FEATURES['cd3_estimator']:
+                cd3_input = st.slider("CD3+ % of lymphocytes", min_value=50.0, max_value=95.0, value=70.0, step=0.5)
         
-    with col2:
-        donor_tlc = st.slider("Donor TLC (×10³/μL)", min_value=2.0, max_value=30.0, value=8.0, step=0.5)
-        lymph_percent = st.slider("Lymphocyte %", min_value=10, max_value=90, value=30)
-        donor_hct = st.slider("Donor Hematocrit (%)", min_value=30.0, max_value=60.0, value=40.0, step=0.1,
-                            help="Critical for collection efficiency and RBC contamination")
+        st.form_submit_button("Calculate")
     
     # Calculate
     dose_cells = dose * 1e6
-    volume, rbc_contamination, params, cd3_percent = calculate_dli(
-        dose_cells, recipient_weight, donor_tlc, lymph_percent, donor_hct, method
+    volume, required_cd3, cd3_conc, rbc_contamination, params, cd3_percent = calculate_dli(
+        dose_cells, recipient_weight, donor_tlc, lymph_percent, donor_hct, method, cd3_input
     )
     
     # Display results with highlighted recommended dose
     st.subheader("Results")
-    st.write(f"**Donor Type:** {donor_type} [Recommended dose: {RECOMMENDED_DOSES[donor_type]} ×10⁶ CD3+ cells/kg]")
-    st.write(f"**Selected Dose:** {dose} ×10⁶ CD3+ cells/kg")
-    st.write(f"**Required CD3+ cells:** {dose * recipient_weight:.1f} ×10⁶ cells")
-    st.write(f"**Estimated CD3+ %:** {cd3_percent:.1f}%")
-    st.write(f"**Effective CD3+ concentration:** {(donor_tlc * 1e3 * (lymph_percent/100) * (cd3_percent/100)):.1f} cells/μL")
-    st.write(f"**Required volume:** {volume:.1f} mL")
-    st.write(f"**Estimated RBC contamination:** {rbc_contamination:.1f} ×10⁹")
+    cd3_label = "Estimated CD3+ %" if cd3_input is None else "CD3+ %"
+    # One markdown table per section instead of a websocket message per line
+    st.markdown(
+        "| Field | Value |\n|---|---|\n"
+        f"| **Donor Type** | {donor_type} [Recommended dose: {RECOMMENDED_DOSES[donor_type]} ×10⁶ CD3+ cells/kg] |\n"
+        f"| **Selected Dose** | {dose} ×10⁶ CD3+ cells/kg |\n"
+        f"| **Required CD3+ cells** | {required_cd3/1e6:.1f} ×10⁶ cells |\n"
+        f"| **{cd3_label}** | {cd3_percent:.1f}% |\n"
+        f"| **Effective CD3+ concentration** | {cd3_conc:.1f} cells/μL |\n"
+        f"| **Required volume** | {volume:.1f} mL |\n"
+        f"| **Estimated RBC contamination** | {rbc_contamination:.1f} ×10⁹ |"
+    )
     
     if method != 'Whole Blood':
         st.subheader("Recommended Parameters")
-        for param, value in params.items():
-            st.write(f"**{param}:** {value}")
+        st.markdown(
+            "| Parameter | Value |\n|---|---|\n"
+            + "\n".join(f"| **{param}** | {value} |" for param, value in params.items())
+        )
         
         # Show HCT warning if needed
-        if donor_hct > 45:
+        if FEATURES['hct'] and donor_hct > 45:
             st.warning(f"High donor hematocrit ({donor_hct}%) - consider:")
             st.markdown("""
             - Reducing flow rate by 10-20%
@@ -141,44 +147,7 @@ def main():
     
     # Plot with recommended dose marker
     st.subheader("Dose-Volume Relationship")
-    fig, ax1 = plt.subplots(figsize=(10, 6))
-    
-    # Generate points for the curve
-    doses = np.linspace(0.5e6, 2e7, 50)
-    volumes = []
-    for d in doses:
-        v, _, _, _ = calculate_dli(d, recipient_weight, donor_tlc, lymph_percent, donor_hct, method)
-        volumes.append(v)
-    
-    # Main volume curve
-    ax1.plot(doses/1e6, volumes, 'b-', linewidth=2, label='Volume Curve')
-    
-    # Current dose marker
-    ax1.scatter([dose], [volume], color='red', s=200, label='Selected Dose')
-    
-    # Recommended dose marker
-    recommended_vol, _, _, _ = calculate_dli(
-        RECOMMENDED_DOSES[donor_type] * 1e6,
-        recipient_weight,
-        donor_tlc,
-        lymph_percent,
-        donor_hct,
-        method
-    )
-    ax1.scatter([RECOMMENDED_DOSES[donor_type]], [recommended_vol], 
-                color='green', s=200, marker='D', label='Recommended Dose')
-    
-    ax1.set_xlabel('DLI Dose (×10⁶ CD3+ cells/kg)')
-    ax1.set_ylabel('Required Volume (mL)', color='b')
-    ax1.grid(True, alpha=0.3)
-    ax1.legend()
-    
-    # Secondary axis for total cells
-    ax2 = ax1.twinx()
-    ax2.plot(doses/1e6, np.array(doses)*recipient_weight/1e8, 'g--', alpha=0.5)
-    ax2.set_ylabel('Total CD3+ Cells (×10⁸)', color='g')
-    
-    st.pyplot(fig)
+    render_plot(dose, volume, donor_type, recipient_weight, donor_tlc, lymph_percent, cd3_percent, donor_hct, method)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,138 @@
+"""DLI collection model: method constants and the cached/JIT-compiled calculations"""
+from typing import NamedTuple
+
+import numpy as np
+import streamlit as st
+from numba import njit
+
+class MethodSpec(NamedTuple):
+    """Collection method constants; apheresis parameters stay 0 for Whole Blood"""
+    efficiency: float
+    volume_factor: float
+    hct_impact: float  # Hematocrit sensitivity
+    rbc_contam: float  # RBC contamination (×10⁹ per L)
+    cd3_a: float  # CD3% estimate: a + b*(TLC/15) + c*(lymph%/50)
+    cd3_b: float
+    cd3_c: float
+    fr_lo: float = 0.0  # Flow rate (mL/min)
+    fr_hi: float = 0.0
+    acd_lo: int = 0  # ACD ratio (1:x)
+    acd_hi: int = 0
+    pr_lo: int = 0  # Plasma removal (mL)
+
+# Constants with hematocrit factors
+METHODS = {
+    'Whole Blood': MethodSpec(
+        efficiency=0.25,
+        volume_factor=1.0,
+        hct_impact=0.2,  # 20% hematocrit sensitivity
+        rbc_contam=50.0,
+        cd3_a=60.0, cd3_b=10.0, cd3_c=5.0
+    ),
+    'Haemonetics': MethodSpec(
+        efficiency=0.85,
+        volume_factor=0.3,
+        hct_impact=0.6,  # 60% hematocrit sensitivity
+        rbc_contam=15.0,  # Higher RBC contamination
+        cd3_a=70.0, cd3_b=15.0, cd3_c=10.0,  # Better CD3+ selection
+        fr_lo=40.0, fr_hi=60.0,
+        acd_lo=11, acd_hi=13,
+        pr_lo=5
+    ),
+    'Spectra Optia': MethodSpec(
+        efficiency=0.95,
+        volume_factor=0.2,
+        hct_impact=0.4,  # 40% hematocrit sensitivity
+        rbc_contam=10.0,  # Lower RBC contamination
+        cd3_a=75.0, cd3_b=20.0, cd3_c=15.0,  # Best CD3+ selection
+        fr_lo=50.0, fr_hi=70.0,
+        acd_lo=12, acd_hi=14,
+        pr_lo=5
+    )
+}
+
+RECOMMENDED_DOSES = {
+    'Matched Sibling': 10,  # 1×10⁷ CD3+/kg
+    'Haploidentical': 1     # 1×10⁶ CD3+/kg (1 log lower)
+}
+
+# float32 literals keep the float32 sweep from promoting to float64; the values
+# are exact, so the float64 path computes with the same constants
+_F4_1 = np.float32(1)
+_F4_40 = np.float32(40)
+_F4_100 = np.float32(100)
+_F4_1E3 = np.float32(1e3)
+
+@njit(['UniTuple(f8, 4)(f8,f8,f8,f8,f8,f8,f8,f8,f8)',
+       'UniTuple(f4, 4)(f4,f4,f4,f4,f4,f4,f4,f4,f4)'], cache=True)
+def _dli_kernel(dose, rw, tlc, lymph, cd3p, hct, eff, vol_factor, hct_impact):
+    """Volume, required CD3+, CD3+ concentration and Hct efficiency for one dose
+    
+    The single copy of the volume model, shared by calculate_dli (float64) and _dli_sweep (float32).
+    """
+    required_cd3 = dose * rw
+    cd3_conc = tlc * _F4_1E3 * (lymph/_F4_100) * (cd3p/_F4_100)
+    # Hematocrit efficiency correction (normalized to 40% Hct)
+    hct_efficiency = _F4_1 - hct_impact * (hct - _F4_40)/_F4_40
+    volume = (required_cd3 / (cd3_conc * eff * hct_efficiency)) * vol_factor / _F4_1E3
+    return volume, required_cd3, cd3_conc, hct_efficiency
+
+@njit('f4[:](f4[:],f4,f4,f4,f4,f4,f4,f4,f4)', cache=True)
+def _dli_sweep(doses, rw, tlc, lymph, cd3p, hct, eff, vol_factor, hct_impact):
+    """Collection volume for each dose in `doses`"""
+    volumes = np.empty_like(doses)
+    for i in range(doses.shape[0]):
+        volumes[i] = _dli_kernel(doses[i], rw, tlc, lymph, cd3p, hct, eff, vol_factor, hct_impact)[0]
+    return volumes
+
+@st.cache_data(max_entries=512)
+def calculate_dli(dose, recipient_weight, donor_tlc, lymph_percent, donor_hct, method, cd3_percent=None):
+    """Calculate required collection volume and optimal parameters for DLI with hematocrit adjustment
+    
+    cd3_percent is estimated from the method, TLC and lymphocyte % unless given.
+    """
+    spec = METHODS[method]
+    
+    cd3_estimated = cd3_percent is None
+    if cd3_estimated:
+        # Estimate CD3% based on method, TLC and lymphocyte %
+        cd3_percent = spec.cd3_a + spec.cd3_b*(donor_tlc/15) + spec.cd3_c*(lymph_percent/50)
+        cd3_percent = float(np.clip(cd3_percent, 50.0, 95.0))  # Keep within reasonable bounds
+    
+    # Adjusted volume calculation with Hct impact
+    volume, required_cd3, cd3_conc, hct_efficiency = _dli_kernel(
+        float(dose), float(recipient_weight), float(donor_tlc), float(lymph_percent), float(cd3_percent),
+        float(donor_hct), spec.efficiency, spec.volume_factor, spec.hct_impact
+    )
+    
+    # RBC contamination calculation
+    rbc_contamination = spec.rbc_contam * (donor_hct/40) * (volume/0.5)  # Normalized to 0.5L
+    
+    params = {}
+    if method != 'Whole Blood':
+        # Adjust flow rate based on Hct
+        base_flow = spec.fr_lo + (spec.fr_hi - spec.fr_lo)*(lymph_percent/100)
+        flow_rate = base_flow * (1 - 0.2*(donor_hct-40)/40)  # Reduce flow for high Hct
+        flow_rate = np.clip(flow_rate, spec.fr_lo, spec.fr_hi)
+        
+        params = {
+            'Flow Rate': f"{flow_rate:.1f} mL/min",
+            'ACD Ratio': f"1:{int((spec.acd_lo + spec.acd_hi)/2 + (1 if donor_hct > 45 else 0))}",
+            'Plasma Removal': f"{spec.pr_lo + (5 if donor_hct > 45 else 0)} mL",
+            'Hct Efficiency': f"{hct_efficiency:.2f}",
+            'Estimated CD3%' if cd3_estimated else 'CD3%': f"{cd3_percent:.1f}%"
+        }
+    return volume, required_cd3, cd3_conc, rbc_contamination, params, cd3_percent
+
+@st.cache_data(max_entries=512)
+def sweep_volumes(recipient_weight, donor_tlc, lymph_percent, cd3_percent, donor_hct, method):
+    """Dose-volume curve for the plot, cached so dose-only changes reuse it"""
+    spec = METHODS[method]
+    # float32 is plenty for a plotted curve and halves the array size
+    doses = np.linspace(0.5e6, 2e7, 50, dtype=np.float32)
+    f4 = np.float32
+    volumes = _dli_sweep(
+        doses, f4(recipient_weight), f4(donor_tlc), f4(lymph_percent), f4(cd3_percent), f4(donor_hct),
+        f4(spec.efficiency), f4(spec.volume_factor), f4(spec.hct_impact)
+    )
+    return doses, volumes
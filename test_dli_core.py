@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from dli_core import METHODS, calculate_dli, sweep_volumes
+
+@pytest.mark.parametrize("method", list(METHODS))
+@pytest.mark.parametrize("donor_hct", [35.0, 40.0, 50.0])
+def test_sweep_matches_calculate_dli(method, donor_hct):
+    """The plotted float32 curve must agree with the displayed float64 volume"""
+    recipient_weight, donor_tlc, lymph_percent = 70, 8.0, 30
+    cd3_percent = calculate_dli(1e7, recipient_weight, donor_tlc, lymph_percent, donor_hct, method)[-1]
+
+    doses, volumes = sweep_volumes(recipient_weight, donor_tlc, lymph_percent, cd3_percent, donor_hct, method)
+    expected = [
+        calculate_dli(float(d), recipient_weight, donor_tlc, lymph_percent, donor_hct, method)[0]
+        for d in doses
+    ]
+    np.testing.assert_allclose(volumes, expected, rtol=1e-6)